@@ -1,24 +1,35 @@
-import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from broker_interface import GenericBroker, OrderRequest
+from allocation import reduction_powers, alloc_multiplier, alloc_cash, alloc_cash_ladder
 import logging
 
 class SequentialAllocationMatrix:
-    def __init__(self, broker: GenericBroker, symbol="TQQQ", reduction_factor=0.95):
+    def __init__(self, broker: GenericBroker, symbol="TQQQ", reduction_factor=0.95,
+                 order_workers=1, max_orders_per_sec=40):
         self.broker = broker
         self.symbol = symbol
         self.R = reduction_factor
         self.logger = logging.getLogger("Strategy")
 
+        # Order submission: order_workers > 1 sends orders concurrently.
+        # Keep it at 1 for brokers whose client is not thread-safe (ib_insync).
+        self.order_workers = order_workers
+        self._min_order_interval = 1.0 / max_orders_per_sec
+        self._rate_lock = threading.Lock()
+        self._next_send_at = 0.0
+
+        # Invariant parts of the allocation formula, computed once
+        self._alloc_const = alloc_multiplier(self.R, 88)
+        self._geo_powers = reduction_powers(self.R, 88)
+
     def calculate_allocation(self, total_cash, level_index):
         """
         Formula: C_alloc = C_total * ((1-R)/(1-R^88)) * R^n
         """
-        numerator = 1 - self.R
-        denominator = 1 - (self.R ** 88)
-        geo_factor = self.R ** level_index
-        
-        allocation = total_cash * (numerator / denominator) * geo_factor
-        return allocation
+        return alloc_cash(total_cash, self._geo_powers, self._alloc_const, level_index, 88)
 
     def execute_initial_setup(self):
         """
@@ -33,46 +44,62 @@ class SequentialAllocationMatrix:
             # Define the 88 levels
             # Level 0 is market entry (or close to it)
             # Level 1 is 1% down from Level 0, etc.
-            
-            for i in range(88):
-                # 1. Calculate Price for this level
-                # Each level is a 1% drop from the INITIAL price (Level 0)
-                # Note: The prompt implies drop value is based on initial purchase
-                drop_percentage = 0.01 * i
-                buy_price = current_price * (1 - drop_percentage)
-                
-                # Round to 2 decimals
-                buy_price = round(buy_price, 2)
-                
-                # 2. Calculate Sell Price (1% profit on this specific lot)
-                # Strategy says: Sell trigger is 1% above buy price
-                sell_price = round(buy_price * 1.01, 2)
-
-                # 3. Calculate Cash Allocation for this level
-                cash_for_level = self.calculate_allocation(total_cash, i)
-                
-                # 4. Calculate Quantity
-                qty = math.floor(cash_for_level / buy_price)
-                
-                if qty < 1:
-                    self.logger.warning(f"Level {i}: Cash {cash_for_level} insufficient for price {buy_price}")
-                    continue
-
-                # 5. Construct Order Request
-                req = OrderRequest(
+            # The grid math is vectorized; prices are rounded per element with
+            # round() because np.round can land a cent away from it.
+            levels = np.arange(88)
+
+            # 1. Calculate Price for each level
+            # Each level is a 1% drop from the INITIAL price (Level 0)
+            # Note: The prompt implies drop value is based on initial purchase
+            # Round to 2 decimals
+            buy_prices = np.array([round(p, 2) for p in (current_price * (1 - 0.01 * levels)).tolist()])
+
+            # 2. Calculate Sell Price (1% profit on each specific lot)
+            # Strategy says: Sell trigger is 1% above buy price
+            sell_prices = np.array([round(p * 1.01, 2) for p in buy_prices.tolist()])
+
+            # 3. Calculate Cash Allocation for each level
+            cash_per_level = alloc_cash_ladder(total_cash, self._geo_powers, self._alloc_const, 88)
+
+            # 4. Calculate Quantity
+            qtys = np.floor(cash_per_level / buy_prices).astype(int)
+
+            for i in np.flatnonzero(qtys < 1):
+                self.logger.warning(f"Level {i}: Cash {cash_per_level[i]} insufficient for price {buy_prices[i]}")
+
+            # 5. Construct Order Requests
+            reqs = [
+                OrderRequest(
                     symbol=self.symbol,
-                    qty=qty,
-                    buy_price=buy_price,
-                    sell_price=sell_price,
+                    qty=int(qtys[i]),
+                    buy_price=float(buy_prices[i]),
+                    sell_price=float(sell_prices[i]),
                     algo_id=f"SEQ_MTRX_Lvl{i}"
                 )
+                for i in np.flatnonzero(qtys >= 1)
+            ]
 
-                # 6. Send to Broker
-                # The broker impl handles the "Wait to trigger" logic via Limit Orders
-                self.broker.place_bracket_order(req)
-                
-                self.logger.info(f"Level {i} Sent: Buy {qty} @ {buy_price}")
+            # 6. Send to Broker
+            # The broker impl handles the "Wait to trigger" logic via Limit Orders
+            if self.order_workers > 1:
+                with ThreadPoolExecutor(max_workers=self.order_workers) as ex:
+                    list(ex.map(self._place_order, reqs))
+            else:
+                for req in reqs:
+                    self._place_order(req)
 
         except Exception as e:
             self.logger.error(f"Critical Strategy Error: {e}")
             # Here is where you implement notification logic (e.g., to Home Assistant)
+
+    def _place_order(self, req: OrderRequest):
+        """Sends one bracket order, pacing submissions to stay under the broker rate limit."""
+        with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_send_at - now
+            self._next_send_at = max(now, self._next_send_at) + self._min_order_interval
+        if wait > 0:
+            time.sleep(wait)
+
+        self.broker.place_bracket_order(req)
+        self.logger.info(f"{req.algo_id} Sent: Buy {req.qty} @ {req.buy_price}")
@@ -0,0 +1,48 @@
+# allocation.py
+"""
+Geometric allocation math for the TQQQ grid strategies.
+
+C_alloc(n) = C_total * ((1-R)/(1-R^levels)) * R^n
+
+The kernels are JIT-compiled with numba when it is installed and run as
+plain Python otherwise.
+"""
+from functools import lru_cache
+from math import floor
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        def decorator(func): return func
+        return decorator
+
+
+@lru_cache(maxsize=None)
+def reduction_powers(reduction_factor: float, total_levels: int) -> np.ndarray:
+    """Returns R**n for n = 0..total_levels, computed once per (R, levels)."""
+    return np.power(reduction_factor, np.arange(total_levels + 1))
+
+@lru_cache(maxsize=None)
+def alloc_multiplier(reduction_factor: float, total_levels: int) -> float:
+    """Returns (1-R)/(1-R^levels), computed once per (R, levels)."""
+    return (1 - reduction_factor) / (1 - reduction_factor ** total_levels)
+
+@njit(cache=True)
+def alloc_cash(total_cash: float, geo_powers: np.ndarray, multiplier: float, level: int, total_levels: int) -> float:
+    """Cash allocated to `level`; geo_powers and multiplier come from reduction_powers() and alloc_multiplier()."""
+    if level >= total_levels:
+        return 0.0
+    return total_cash * multiplier * geo_powers[level]
+
+@njit(cache=True)
+def alloc_shares(total_cash: float, geo_powers: np.ndarray, multiplier: float, level: int, total_levels: int, price: float) -> int:
+    """Whole shares that the cash allocated to `level` buys at `price`."""
+    shares = floor(alloc_cash(total_cash, geo_powers, multiplier, level, total_levels) / price)
+    return max(0, shares)
+
+def alloc_cash_ladder(total_cash: float, geo_powers: np.ndarray, multiplier: float, total_levels: int) -> np.ndarray:
+    """Cash allocated to every level 0..total_levels-1 in one vectorized pass."""
+    return total_cash * multiplier * geo_powers[:total_levels]
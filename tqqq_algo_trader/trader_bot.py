@@ -1,14 +1,18 @@
 # trader_bot.py
 import time
 import os
+import threading
+from datetime import datetime, timezone
+import numpy as np
 import pandas as pd
-from math import floor
 from alpaca.trading.client import TradingClient
 from alpaca.trading.requests import LimitOrderRequest, TakeProfitRequest
-from alpaca.trading.enums import OrderSide, OrderClass, TimeInForce, OrderStatus
+from alpaca.trading.enums import OrderSide, OrderClass, TimeInForce
 from alpaca.data.requests import StockLatestQuoteRequest, StockLatestTradeRequest
 from alpaca.data.historical import StockHistoricalDataClient
+from alpaca.data.live import StockDataStream
 import logging 
+from allocation import reduction_powers, alloc_multiplier, alloc_shares
 
 # --- Logging Setup ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,6 +29,7 @@ if not API_KEY or not SECRET_KEY:
 SYMBOL = "TQQQ"
 LEDGER_FILE = "/config/tqqq_ledger.csv"
 POLL_INTERVAL_SEC = 15 
+STREAM_STALE_SEC = 60
 TOTAL_LEVELS = 88
 
 # Strategy Parameters
@@ -35,28 +40,86 @@ PROFIT_TARGET_PERCENT = 0.0100
 # --- Alpaca Clients ---
 trading_client = TradingClient(API_KEY, SECRET_KEY, paper=True) 
 data_client = StockHistoricalDataClient(API_KEY, SECRET_KEY)
+data_stream = StockDataStream(API_KEY, SECRET_KEY)
+
+# Lookup index over the ledger rows, kept in sync by index_ledger/add_lot
+_lots_by_level: dict[int, dict] = {}
+_open_levels: set[int] = set()
+
+# Grid trigger prices (cents) for every level, built once per anchor price
+_grid_anchor_cents: int | None = None
+_grid_triggers: np.ndarray | None = None
+
+# Last market clock answer, valid until the next open/close boundary
+_market_open_cached: bool | None = None
+_market_clock_valid_until: datetime | None = None
+
+# Latest ASK pushed by the quote stream, read by the main loop
+_latest_ask: float | None = None
+_latest_ask_at = 0.0
+_price_lock = threading.Lock()
 
 # --- 1. Ledger Management ---
 
-def load_ledger() -> pd.DataFrame:
-    """Loads the lot ledger from a persistent CSV file."""
-    if os.path.exists(LEDGER_FILE):
-        return pd.read_csv(LEDGER_FILE)
-    
-    return pd.DataFrame({
-        'lot_id': pd.Series(dtype='str'),
-        'purchase_price': pd.Series(dtype='float'),
-        'shares': pd.Series(dtype='int'),
-        'target_sell_price': pd.Series(dtype='float'),
-        'alpaca_order_id': pd.Series(dtype='str'),
-        'is_open': pd.Series(dtype='bool'),
-        'level': pd.Series(dtype='int')
-    })
-
-def save_ledger(ledger_df: pd.DataFrame):
+# Prices are stored as integer cents and only converted to dollars at the API boundary
+LEDGER_DTYPES = {
+    'lot_id': 'str',
+    'purchase_price_cents': 'int32',
+    'shares': 'int64',
+    'target_sell_price_cents': 'int32',
+    'alpaca_order_id': 'str',
+    'is_open': 'bool',
+    'level': 'int64'
+}
+
+# Older ledgers stored prices as float dollars; read_csv ignores dtypes for absent columns
+LEGACY_PRICE_DTYPES = {
+    'purchase_price': 'float64',
+    'target_sell_price': 'float64'
+}
+
+def to_cents(price: float) -> int:
+    return int(round(price * 100))
+
+def from_cents(cents: int) -> float:
+    return cents / 100.0
+
+def _migrate_dollar_columns(ledger_df: pd.DataFrame) -> pd.DataFrame:
+    """Converts ledgers with float dollar price columns to integer cents."""
+    for column in ('purchase_price', 'target_sell_price'):
+        if column in ledger_df:
+            ledger_df[f"{column}_cents"] = (ledger_df.pop(column) * 100).round().astype('int32')
+    return ledger_df
+
+def load_ledger() -> list[dict]:
+    """Loads the lot ledger from a persistent CSV file as a list of lot rows."""
+    try:
+        ledger_df = pd.read_csv(LEDGER_FILE, dtype={**LEDGER_DTYPES, **LEGACY_PRICE_DTYPES})
+    except FileNotFoundError:
+        return []
+    return _migrate_dollar_columns(ledger_df).to_dict('records')
+
+def index_ledger(ledger: list[dict]):
+    """Rebuilds the by-level lookup and the set of open levels from the ledger rows."""
+    _lots_by_level.clear()
+    _open_levels.clear()
+    for lot in ledger:
+        _lots_by_level[lot['level']] = lot
+        if lot['is_open']:
+            _open_levels.add(lot['level'])
+
+def add_lot(ledger: list[dict], lot: dict):
+    """Appends a lot row to the ledger and its lookup index."""
+    ledger.append(lot)
+    _lots_by_level[lot['level']] = lot
+    if lot['is_open']:
+        _open_levels.add(lot['level'])
+
+def save_ledger(ledger: list[dict]):
     """Saves the current lot ledger to CSV."""
+    ledger_df = pd.DataFrame(ledger, columns=list(LEDGER_DTYPES)).astype(LEDGER_DTYPES)
     ledger_df.to_csv(LEDGER_FILE, index=False)
-    logger.info(f"Ledger saved with {len(ledger_df[ledger_df['is_open']])} open lots.")
+    logger.info("Ledger saved with %d open lots.", len(_open_levels))
 
 
 # --- 2. Trading Functions (Core Logic) ---
@@ -65,37 +128,32 @@ def calculate_shares_to_buy(
     starting_cash: float, 
     reduction_factor: float, 
     lots_held_before: int, 
-    current_price: float
+    price_cents: int
 ) -> int:
-    """Calculates the share quantity for the next purchase."""
-    if lots_held_before >= TOTAL_LEVELS:
-        return 0
-
-    multiplier = (1 - reduction_factor) / (1 - (reduction_factor ** TOTAL_LEVELS))
-    reduction_scaling = reduction_factor ** lots_held_before
-    cash_to_invest = starting_cash * multiplier * reduction_scaling
-    
-    shares_to_buy = floor(cash_to_invest / current_price)
-    
-    return max(0, shares_to_buy) 
+    """Calculates the share quantity for the next purchase at a price given in cents."""
+    return int(alloc_shares(
+        float(starting_cash), reduction_powers(reduction_factor, TOTAL_LEVELS),
+        alloc_multiplier(reduction_factor, TOTAL_LEVELS),
+        int(lots_held_before), TOTAL_LEVELS, from_cents(price_cents)
+    ))
 
 def submit_bracket_order(
     qty_to_buy: int, 
-    entry_price: float, 
-    take_profit_price: float,
+    entry_price_cents: int, 
+    take_profit_price_cents: int,
     lot_id: str
 ) -> str | None:
     """Submits a GTC Limit Buy order with an attached Take-Profit Sell limit order."""
     
     take_profit_request = TakeProfitRequest(
-        limit_price=round(take_profit_price, 2)
+        limit_price=from_cents(take_profit_price_cents)
     )
 
     bracket_order_data = LimitOrderRequest(
         symbol=SYMBOL,
         qty=qty_to_buy,
         side=OrderSide.BUY,
-        limit_price=round(entry_price, 2),
+        limit_price=from_cents(entry_price_cents),
         time_in_force=TimeInForce.GTC,
         order_class=OrderClass.BRACKET,
         take_profit=take_profit_request,
@@ -105,15 +163,39 @@ def submit_bracket_order(
 
     try:
         order = trading_client.submit_order(order_data=bracket_order_data)
-        logger.info(f"Submitted Bracket Order | Lot ID: {lot_id} | Entry: ${entry_price:.2f}")
+        logger.info("Submitted Bracket Order | Lot ID: %s | Entry: $%.2f", lot_id, from_cents(entry_price_cents))
         return order.id
     except Exception as e:
-        logger.error(f"Error submitting bracket order for {lot_id}: {e}")
+        logger.error("Error submitting bracket order for %s: %s", lot_id, e)
         return None
 
 # --- 3. Polling and Market Status ---
 
+async def _on_quote(quote):
+    """Stream handler: records the latest non-zero ASK price."""
+    global _latest_ask, _latest_ask_at
+    if quote.ask_price and quote.ask_price > 0:
+        with _price_lock:
+            _latest_ask = quote.ask_price
+            _latest_ask_at = time.monotonic()
+
+def start_price_stream():
+    """Subscribes to TQQQ quotes over WebSocket in a background thread."""
+    data_stream.subscribe_quotes(_on_quote, SYMBOL)
+    threading.Thread(target=data_stream.run, name="price-stream", daemon=True).start()
+    logger.info("Quote stream started for %s", SYMBOL)
+
 def fetch_tqqq_price() -> float | None:
+    """Returns the latest streamed ASK price, falling back to REST polling if the stream is stale."""
+    with _price_lock:
+        ask_price, received_at = _latest_ask, _latest_ask_at
+
+    if ask_price and time.monotonic() - received_at < STREAM_STALE_SEC:
+        return ask_price
+
+    return fetch_tqqq_price_rest()
+
+def fetch_tqqq_price_rest() -> float | None:
     """Uses API polling to get the latest ASK price for TQQQ."""
     try:
         quote_request = StockLatestQuoteRequest(symbol_or_symbols=SYMBOL)
@@ -130,7 +212,7 @@ def fetch_tqqq_price() -> float | None:
         return last_trade[SYMBOL].price if last_trade[SYMBOL].price > 0 else None
         
     except Exception as e:
-        logger.error(f"Error fetching price: {e}")
+        logger.error("Error fetching price: %s", e)
         return None
 
 def is_market_open() -> bool:
@@ -139,133 +221,172 @@ def is_market_open() -> bool:
     Returns True for extended hours (pre-market 4AM-9:30AM ET, after-hours 4PM-8PM ET)
     and regular hours. Returns False only on weekends and holidays.
     """
+    global _market_open_cached, _market_clock_valid_until
+    if _market_open_cached is not None and datetime.now(timezone.utc) < _market_clock_valid_until:
+        return _market_open_cached
+
     try:
         clock = trading_client.get_clock()
         # Trade during regular hours OR if the next open is today (extended hours available)
-        if clock.is_open:
-            return True
         # Check if we're on a trading day (not weekend/holiday)
         # If next_open and next_close are on the same day, we're in extended hours
-        if clock.next_open.date() == clock.next_close.date():
-            return True
         # Otherwise we're on a weekend or holiday
-        return False
+        market_open = clock.is_open or clock.next_open.date() == clock.next_close.date()
+
+        # The answer can only change once the next open or close passes
+        _market_open_cached = market_open
+        _market_clock_valid_until = min(clock.next_open, clock.next_close)
+        return market_open
     except Exception as e:
-        logger.error(f"Error checking market clock: {e}")
+        logger.error("Error checking market clock: %s", e)
         return True 
 
 # --- 4. Reconciliation and Decision Logic ---
 
-def reconciliation_check(ledger_df: pd.DataFrame) -> pd.DataFrame:
-    """Checks for filled orders on Alpaca and updates the ledger."""
-    if ledger_df.empty:
-        return ledger_df
+def get_grid_triggers(anchor_cents: int) -> np.ndarray:
+    """Returns the buy trigger price (cents) of every level, rebuilding the table only when the anchor changes."""
+    global _grid_anchor_cents, _grid_triggers
+    if _grid_triggers is None or _grid_anchor_cents != anchor_cents:
+        _grid_anchor_cents = anchor_cents
+        _grid_triggers = np.round(anchor_cents * (1 - np.arange(TOTAL_LEVELS) * PROFIT_TARGET_PERCENT)).astype(np.int64)
+    return _grid_triggers
 
-    closed_orders = trading_client.get_orders(status=OrderStatus.CLOSED, nested=True)
-    
-    return ledger_df
+def reconciliation_check(ledger: list[dict]) -> tuple[list[dict], bool]:
+    """Checks for filled orders on Alpaca and updates the ledger.
+
+    Returns the ledger and whether any row was changed.
+    """
+    if not ledger:
+        return ledger, False
 
-def trading_logic(ledger_df: pd.DataFrame, current_price: float, starting_cash: float) -> pd.DataFrame:
-    """Determines if a new buy order should be placed."""
+    # Fills are not matched back to lots yet, so no orders are fetched. When they are,
+    # filter with after= the oldest open lot's submit time (Alpaca's after= is submit time,
+    # and GTC brackets fill long after) and match rows by alpaca_order_id.
+    return ledger, False
+
+def trading_logic(ledger: list[dict], current_price: float, starting_cash: float) -> tuple[list[dict], bool]:
+    """Determines if a new buy order should be placed.
+
+    Returns the ledger and whether a new lot was added.
+    """
+    changed = False
+    price_cents = to_cents(current_price)
 
-    open_lots = ledger_df[ledger_df['is_open']]
-    
     # --- 1. INITIAL BUY CHECK ---
-    if open_lots.empty:
+    if not _open_levels:
         logger.info("Ledger is empty. Attempting initial buy sequence.")
         
-        latest_purchase_price = current_price
-        shares = calculate_shares_to_buy(starting_cash, REDUCTION_FACTOR, 0, latest_purchase_price)
+        latest_purchase_cents = price_cents
+        shares = calculate_shares_to_buy(starting_cash, REDUCTION_FACTOR, 0, latest_purchase_cents)
         
         if shares > 0:
-            target_sell_price = latest_purchase_price * (1 + PROFIT_TARGET_PERCENT)
+            target_sell_cents = int(round(latest_purchase_cents * (1 + PROFIT_TARGET_PERCENT)))
             lot_id = f"TQQQ_L0_RF{str(REDUCTION_FACTOR).replace('.', '')}_{int(time.time())}"
             
-            order_id = submit_bracket_order(shares, latest_purchase_price, target_sell_price, lot_id)
+            order_id = submit_bracket_order(shares, latest_purchase_cents, target_sell_cents, lot_id)
             
             if order_id:
-                new_row = pd.DataFrame([{
+                add_lot(ledger, {
                     'lot_id': lot_id,
-                    'purchase_price': latest_purchase_price,
+                    'purchase_price_cents': latest_purchase_cents,
                     'shares': shares,
-                    'target_sell_price': target_sell_price,
+                    'target_sell_price_cents': target_sell_cents,
                     'alpaca_order_id': order_id,
                     'is_open': True,
                     'level': 0
-                }])
-                ledger_df = pd.concat([ledger_df, new_row], ignore_index=True)
-                logger.info(f"Initial Lot L0 submitted: {shares} shares @ ${latest_purchase_price:.2f}")
+                })
+                changed = True
+                get_grid_triggers(latest_purchase_cents)
+                logger.info("Initial Lot L0 submitted: %d shares @ $%.2f", shares, from_cents(latest_purchase_cents))
         
     # --- 2. GRID ENTRY CHECK ---
     else:
-        deepest_level = open_lots['level'].max()
-        anchor_lot = ledger_df[ledger_df['level'] == 0].iloc[0]
-        anchor_price = anchor_lot['purchase_price']
+        deepest_level = max(_open_levels)
+        if _grid_triggers is None:
+            get_grid_triggers(_lots_by_level[0]['purchase_price_cents'])
         next_buy_level = deepest_level + 1
-        next_buy_price_target = anchor_price * (1 - (next_buy_level * PROFIT_TARGET_PERCENT))
         
-        if current_price <= next_buy_price_target and next_buy_level < TOTAL_LEVELS:
-            logger.info(f"Price dropped to level {next_buy_level}. Submitting next grid buy.")
+        if next_buy_level < TOTAL_LEVELS and price_cents <= _grid_triggers[next_buy_level]:
+            next_buy_cents = int(_grid_triggers[next_buy_level])
+            logger.info("Price dropped to level %d. Submitting next grid buy.", next_buy_level)
             
-            shares = calculate_shares_to_buy(starting_cash, REDUCTION_FACTOR, next_buy_level, next_buy_price_target)
+            shares = calculate_shares_to_buy(starting_cash, REDUCTION_FACTOR, next_buy_level, next_buy_cents)
 
             if shares > 0:
-                target_sell_price = anchor_price * (1 - ((next_buy_level - 1) * PROFIT_TARGET_PERCENT))
+                target_sell_cents = int(_grid_triggers[next_buy_level - 1])
                 lot_id = f"TQQQ_L{next_buy_level}_RF{str(REDUCTION_FACTOR).replace('.', '')}_{int(time.time())}"
                 
-                order_id = submit_bracket_order(shares, next_buy_price_target, target_sell_price, lot_id)
+                order_id = submit_bracket_order(shares, next_buy_cents, target_sell_cents, lot_id)
                 
                 if order_id:
-                    new_row = pd.DataFrame([{
+                    add_lot(ledger, {
                         'lot_id': lot_id,
-                        'purchase_price': next_buy_price_target,
+                        'purchase_price_cents': next_buy_cents,
                         'shares': shares,
-                        'target_sell_price': target_sell_price,
+                        'target_sell_price_cents': target_sell_cents,
                         'alpaca_order_id': order_id,
                         'is_open': True,
                         'level': next_buy_level
-                    }])
-                    ledger_df = pd.concat([ledger_df, new_row], ignore_index=True)
-                    logger.info(f"Grid Buy L{next_buy_level} submitted: {shares} shares @ ${next_buy_price_target:.2f}")
+                    })
+                    changed = True
+                    logger.info("Grid Buy L%d submitted: %d shares @ $%.2f", next_buy_level, shares, from_cents(next_buy_cents))
 
-    return ledger_df
+    return ledger, changed
 
 
 # --- 5. Main Execution Loop ---
 
+def sleep_until_next_tick(next_tick: float) -> float:
+    """Sleeps until the next poll tick on the monotonic clock and returns the tick after it.
+
+    Cycle time is subtracted from the sleep so the poll cadence stays at
+    POLL_INTERVAL_SEC; ticks missed by a slow cycle are skipped, not queued.
+    """
+    now = time.monotonic()
+    if next_tick < now:
+        next_tick = now
+    time.sleep(next_tick - now)
+    return next_tick + POLL_INTERVAL_SEC
+
 def main():
     """The main execution loop for the trading bot."""
     logger.info("--- Starting TQQQ Algo Trader (Paper Mode) ---")
     
-    ledger_df = load_ledger()
+    ledger = load_ledger()
+    index_ledger(ledger)
+    start_price_stream()
+    next_tick = time.monotonic() + POLL_INTERVAL_SEC
     
     while True:
         try:
             if not is_market_open():
                 logger.info("Market closed. Sleeping for 1 hour.")
                 time.sleep(3600)
+                next_tick = time.monotonic() + POLL_INTERVAL_SEC
                 continue
             
             current_price = fetch_tqqq_price()
             if not current_price:
                 logger.warning("Failed to fetch price. Skipping cycle.")
-                time.sleep(POLL_INTERVAL_SEC)
+                next_tick = sleep_until_next_tick(next_tick)
                 continue
             
-            logger.info(f"--- Cycle Start | Price: ${current_price:.2f} ---")
+            logger.info("--- Cycle Start | Price: $%.2f ---", current_price)
 
-            ledger_df = reconciliation_check(ledger_df)
-            ledger_df = trading_logic(ledger_df, current_price, STARTING_CASH)
-            save_ledger(ledger_df)
+            ledger, reconciled_changes = reconciliation_check(ledger)
+            ledger, trading_changes = trading_logic(ledger, current_price, STARTING_CASH)
+            if reconciled_changes or trading_changes:
+                save_ledger(ledger)
             
-            time.sleep(POLL_INTERVAL_SEC)
+            next_tick = sleep_until_next_tick(next_tick)
 
         except KeyboardInterrupt:
             logger.info("\nShutting down bot via manual interrupt...")
             break
         except Exception as e:
-            logger.error(f"CRITICAL ERROR in main loop: {e}", exc_info=True)
+            logger.error("CRITICAL ERROR in main loop: %s", e, exc_info=True)
             time.sleep(60)
+            next_tick = time.monotonic() + POLL_INTERVAL_SEC
 
 if __name__ == '__main__':
     main()
@@ -1,40 +1,92 @@
 # tqqq_algo_trader_v2/trader_bot.py
 import asyncio
+import json
 import os
 import sqlite3
 import time
 import logging
+import logging.handlers
+import atexit
+import queue
+import threading
+from collections import deque
+from contextlib import closing
+from bisect import bisect_right, insort
 from dataclasses import dataclass
-from typing import List, Optional
-from datetime import datetime, timedelta
+from functools import lru_cache, partial
+from typing import Dict, List, Optional
+from datetime import date, datetime, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo
 
+import numpy as np
 import yaml
 from aiohttp import web
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # ---------- Alpaca-py Imports ----------
 from alpaca.trading.client import TradingClient
-from alpaca.trading.requests import LimitOrderRequest
-from alpaca.trading.enums import OrderSide, TimeInForce
+from alpaca.trading.requests import LimitOrderRequest, GetOrdersRequest, GetCalendarRequest
+from alpaca.trading.enums import OrderSide, TimeInForce, QueryOrderStatus
 from alpaca.data.historical import StockHistoricalDataClient
+from alpaca.data.live import StockDataStream
 from alpaca.data.requests import StockLatestTradeRequest, StockBarsRequest
 from alpaca.data.timeframe import TimeFrame
 
 # ---------- Logging ----------
 LOG_FILE = os.environ.get("LOG_FILE", "/data/tqqq-bot/bot.log")
-logging.basicConfig(level=logging.INFO,
-                    format="%(asctime)s %(levelname)s: %(message)s",
-                    handlers=[logging.FileHandler(LOG_FILE),
-                              logging.StreamHandler()])
+LOG_FORMAT = "%(asctime)s %(levelname)s: %(message)s"
+
+# Callers only enqueue records; file and console writes happen on the listener's thread
+_log_queue = queue.SimpleQueue()
+_log_queue_handler = logging.handlers.QueueHandler(_log_queue)
+_log_queue_handler.setFormatter(logging.Formatter())  # message (+ traceback) only; the sinks add the prefix
+_log_sinks = [logging.FileHandler(LOG_FILE), logging.StreamHandler()]
+for _h in _log_sinks:
+    _h.setFormatter(logging.Formatter(LOG_FORMAT))
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_sinks)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.basicConfig(level=logging.INFO, handlers=[_log_queue_handler])
 
 logger = logging.getLogger("tqqq-bot")
 
+class RingHandler(logging.Handler):
+    """Keeps the most recent formatted log lines in memory so the web UI never touches the log file."""
+    def __init__(self, maxlen: int):
+        super().__init__()
+        self.buffer = deque(maxlen=maxlen)
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def lines(self, n: int) -> List[str]:
+        with self.lock:
+            return list(self.buffer)[-n:]
+
+    def clear(self):
+        with self.lock:
+            self.buffer.clear()
+
 # ---------- Config ----------
 BOT_CONFIG = os.environ.get("BOT_CONFIG", "/data/tqqq-bot/config.yaml")
 LEDGER_DB = os.environ.get("LEDGER_DB", "/data/tqqq-bot/ledger_v2.db")
 
+# libyaml's C loader when PyYAML was built with it; same safe semantics as yaml.safe_load
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 try:
     with open(BOT_CONFIG, 'r') as f:
-        cfg = yaml.safe_load(f)
+        cfg = yaml.load(f, Loader=_YamlLoader)
 except FileNotFoundError:
     logger.error(f"Config file not found at {BOT_CONFIG}")
     cfg = {}
@@ -45,27 +97,72 @@ except Exception:
 # --- Environment Configuration ---
 ALPACA_API_KEY = os.environ.get("ALPACA_API_KEY") 
 ALPACA_API_SECRET = os.environ.get("ALPACA_SECRET_KEY")
-USE_PAPER = cfg.get("alpaca", {}).get("use_paper", True)
-
-SYMBOL = cfg.get("symbol", "TQQQ")
-RF = float(cfg.get("reduction_factor", 0.95))
-LEVELS = int(cfg.get("levels", 88))
-INITIAL_CASH = float(cfg.get("initial_cash", 250000))
-POLL_MS = int(cfg.get("poll_interval_ms", 500))
-MIN_ORDER_SHARES = int(cfg.get("min_order_shares", 1))
-MAX_POSITION_SHARES = int(cfg.get("max_position_shares", 200000))
-WEBUI_PORT = int(cfg.get("webui", {}).get("port", 8080))
-LOG_TAIL = int(cfg.get("log_tail_lines", 200))
+
+# ---------- Bot settings (read once from BOT_CONFIG) ----------
+@dataclass(frozen=True, slots=True)
+class BotConfig:
+    use_paper: bool
+    symbol: str
+    rf: float
+    levels: int
+    initial_cash: float
+    poll_seconds: float
+    min_order_shares: int
+    max_position_shares: int
+    webui_port: int
+    log_tail: int
+
+    @classmethod
+    def from_dict(cls, raw: dict) -> "BotConfig":
+        alpaca = raw.get("alpaca") or {}
+        webui = raw.get("webui") or {}
+        return cls(
+            use_paper=bool(alpaca.get("use_paper", True)),
+            symbol=raw.get("symbol", "TQQQ"),
+            rf=float(raw.get("reduction_factor", 0.95)),
+            levels=int(raw.get("levels", 88)),
+            initial_cash=float(raw.get("initial_cash", 250000)),
+            poll_seconds=int(raw.get("poll_interval_ms", 500)) / 1000,
+            min_order_shares=int(raw.get("min_order_shares", 1)),
+            max_position_shares=int(raw.get("max_position_shares", 200000)),
+            webui_port=int(webui.get("port", 8080)),
+            log_tail=int(raw.get("log_tail_lines", 200)),
+        )
+
+CFG = BotConfig.from_dict(cfg or {})
+
+QUOTE_CACHE_TTL_SEC = 0.25
+STREAM_STALE_SEC = 60
+RECONCILE_INTERVAL_SEC = 5
+RECONCILE_CONCURRENCY = 8
+WAL_CHECKPOINT_INTERVAL_SEC = 600
+PENDING_LOOKAHEAD = 10
+PAUSED_LOG_INTERVAL_SEC = 60
+
+# The web UI asks for up to 200 lines on the index page and log_tail lines on /api/logs
+log_ring = RingHandler(max(CFG.log_tail, 200))
+log_ring.setFormatter(logging.Formatter(LOG_FORMAT))
 
 # ---------- Alpaca Client Setup ----------
 api: Optional[TradingClient] = None
 data_api: Optional[StockHistoricalDataClient] = None
 
+def _tune_http_pool(client):
+    """Mounts a keep-alive pool on the SDK's requests session, sized for the worker-thread calls."""
+    session = getattr(client, "_session", None)
+    if session is not None:
+        # Up to 32 to_thread workers (the default executor's cap) can hit the API at once, e.g. during
+        # reconcile fallbacks; urllib3 won't retry a POST once it was sent, only failed connects
+        retry = Retry(total=2, backoff_factor=0.1)
+        session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retry))
+
 if ALPACA_API_KEY and ALPACA_API_SECRET:
     try:
-        api = TradingClient(ALPACA_API_KEY, ALPACA_API_SECRET, paper=USE_PAPER)
+        api = TradingClient(ALPACA_API_KEY, ALPACA_API_SECRET, paper=CFG.use_paper)
         data_api = StockHistoricalDataClient(ALPACA_API_KEY, ALPACA_API_SECRET)
-        logger.info(f"Alpaca clients initialized (Paper: {USE_PAPER})")
+        _tune_http_pool(api)
+        _tune_http_pool(data_api)
+        logger.info(f"Alpaca clients initialized (Paper: {CFG.use_paper})")
     except Exception as e:
         logger.error(f"Failed to initialize Alpaca clients: {e}")
         api = None
@@ -75,19 +172,66 @@ else:
 
 
 # ---------- SQLite ledger setup ----------
-conn = sqlite3.connect(LEDGER_DB, check_same_thread=False)
+conn = sqlite3.connect(LEDGER_DB, check_same_thread=False, cached_statements=256)
 cur = conn.cursor()
+# WAL lets the web UI read while the trading loop writes. With synchronous=NORMAL a
+# power loss can drop the last few committed transactions (never corrupts the file);
+# that is acceptable here because lots are reconciled against Alpaca's orders anyway.
 cur.executescript("""
+PRAGMA journal_mode=WAL;
+PRAGMA synchronous=NORMAL;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-20000;
+PRAGMA mmap_size=134217728;
+PRAGMA busy_timeout=5000;
+""")
+# Lot status codes stored in virtual_lots.status; the web UI and API show the names
+PENDING, OPEN, CLOSED, ORDER_SENT = 0, 1, 2, 3
+STATUS_NAMES = {PENDING: "PENDING", OPEN: "OPEN", CLOSED: "CLOSED", ORDER_SENT: "ORDER_SENT"}
+
+# Lot prices are stored as integer cents and only converted to dollars at the API boundary
+VIRTUAL_LOTS_DDL = """
 CREATE TABLE IF NOT EXISTS virtual_lots (
     level INTEGER PRIMARY KEY,
     virtual_shares INTEGER,
     virtual_cost REAL,
-    buy_price REAL,
-    sell_target REAL,
-    status TEXT,
+    buy_price_cents INTEGER,
+    sell_target_cents INTEGER,
+    status INTEGER NOT NULL CHECK (status IN (0, 1, 2, 3)),
     created_at INTEGER,
     alpaca_order_id TEXT
 );
+"""
+# 1: prices as integer cents, 2: integer status codes
+SCHEMA_VERSION = 2
+
+def migrate_schema():
+    """Upgrades a ledger written by an older version, tracked with PRAGMA user_version."""
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    lot_columns = {r[1] for r in cur.execute("PRAGMA table_info(virtual_lots)")}
+
+    if lot_columns and version < SCHEMA_VERSION:
+        # Recreate the table so converted columns get INTEGER affinity and the status CHECK
+        buy_cents = "CAST(ROUND(buy_price * 100) AS INTEGER)" if "buy_price" in lot_columns else "buy_price_cents"
+        sell_cents = "CAST(ROUND(sell_target * 100) AS INTEGER)" if "sell_target" in lot_columns else "sell_target_cents"
+        status_code = "CASE status " + " ".join(f"WHEN '{name}' THEN {code}" for code, name in STATUS_NAMES.items()) + " ELSE status END"
+        cur.executescript(f"""
+        BEGIN;
+        ALTER TABLE virtual_lots RENAME TO virtual_lots_old;
+        {VIRTUAL_LOTS_DDL}
+        INSERT INTO virtual_lots
+            SELECT level, virtual_shares, virtual_cost, {buy_cents}, {sell_cents},
+                   {status_code}, created_at, alpaca_order_id
+            FROM virtual_lots_old;
+        DROP TABLE virtual_lots_old;
+        COMMIT;
+        """)
+        logger.info(f"Migrated virtual_lots to schema version {SCHEMA_VERSION}")
+
+    cur.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+migrate_schema()
+cur.executescript(VIRTUAL_LOTS_DDL + """
 CREATE TABLE IF NOT EXISTS orders (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     alpaca_id TEXT,
@@ -101,8 +245,64 @@ CREATE TABLE IF NOT EXISTS meta (
     key TEXT PRIMARY KEY,
     val TEXT
 );
+CREATE INDEX IF NOT EXISTS idx_lots_status_level ON virtual_lots(status, level);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status);
 """)
-conn.commit()
+def analyze_if_missing_stats() -> bool:
+    """Gives the planner index statistics once the ledger has rows; later runs keep them.
+
+    ANALYZE on an empty table records nothing, so this is also re-checked on the
+    maintenance cadence to pick up a ledger seeded after startup.
+    """
+    if (cur.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'").fetchone()
+            and cur.execute("SELECT 1 FROM sqlite_stat1 WHERE tbl='virtual_lots'").fetchone()):
+        return False
+    cur.execute("ANALYZE")
+    conn.commit()
+    return True
+
+analyze_if_missing_stats()
+
+# Statements run every tick or reconcile pass. sqlite3 caches prepared
+# statements by SQL text, so these are always passed as the same constant.
+SQL_SELECT_LOTS = "SELECT level, virtual_shares, virtual_cost, buy_price_cents, sell_target_cents, status, alpaca_order_id FROM virtual_lots"
+SQL_SELECT_LEVELS = "SELECT level, virtual_shares, virtual_cost, buy_price_cents, sell_target_cents, status FROM virtual_lots ORDER BY level"
+SQL_INSERT_LOTS = """INSERT OR IGNORE INTO virtual_lots
+    (level, virtual_shares, virtual_cost, buy_price_cents, sell_target_cents, status, created_at, alpaca_order_id)
+    VALUES (?,?,?,?,?,?,?,?)"""
+SQL_UPDATE_LOT_STATUS = "UPDATE virtual_lots SET status=?, alpaca_order_id=COALESCE(?, alpaca_order_id) WHERE level=?"
+SQL_INSERT_ORDER = "INSERT INTO orders (alpaca_id, side, qty, price, status, created_at) VALUES (?,?,?,?,?,?)"
+SQL_SELECT_UNRESOLVED_ORDERS = "SELECT id, alpaca_id, side, created_at FROM orders WHERE status NOT IN ('filled','canceled','expired')"
+SQL_UPDATE_ORDER_STATUS = "UPDATE orders SET status=? WHERE id=?"
+SQL_SELECT_META = "SELECT val FROM meta WHERE key=?"
+SQL_UPSERT_META = "INSERT OR REPLACE INTO meta (key,val) VALUES (?,?)"
+# Auto-checkpoints never shrink the -wal file; TRUNCATE resets it to zero bytes
+SQL_WAL_CHECKPOINT = "PRAGMA wal_checkpoint(TRUNCATE)"
+
+# Web UI reads run in worker threads on their own read-only connections;
+# WAL lets them read alongside the trading loop's writes on `conn`.
+_read_local = threading.local()
+
+def _read_conn() -> sqlite3.Connection:
+    rc = getattr(_read_local, "conn", None)
+    if rc is None:
+        rc = sqlite3.connect(f"file:{LEDGER_DB}?mode=ro", uri=True)
+        rc.execute("PRAGMA busy_timeout=5000")
+        _read_local.conn = rc
+    return rc
+
+def _sync_db(query: str, params: tuple = ()) -> list:
+    return _read_conn().execute(query, params).fetchall()
+
+async def _db(query: str, params: tuple = ()) -> list:
+    """Runs a read-only query off the event loop."""
+    return await asyncio.to_thread(_sync_db, query, params)
+
+def _checkpoint_wal():
+    """Truncates the WAL from a worker thread on its own connection, so the checkpoint's fsyncs never stall the loop."""
+    with closing(sqlite3.connect(LEDGER_DB)) as wc:
+        wc.execute("PRAGMA busy_timeout=5000")
+        wc.execute(SQL_WAL_CHECKPOINT)
 
 
 @dataclass
@@ -110,30 +310,154 @@ class VirtualLot:
     level: int
     virtual_shares: int
     virtual_cost: float
-    buy_price: float
-    sell_target: float
-    status: str 
+    buy_price_cents: int
+    sell_target_cents: int
+    status: int
+    alpaca_order_id: Optional[str] = None
+
+# ---------- In-memory lot cache ----------
+# Mirrors virtual_lots so the trading loop does not query SQLite every poll.
+# All writes to virtual_lots go through insert_virtual_lots / set_lot_status,
+# which update the table and the cache together.
+lots_by_level: Dict[int, VirtualLot] = {}
+open_lots: List[VirtualLot] = []      # status OPEN, sell_target_cents ascending
+pending_lots: List[VirtualLot] = []   # status PENDING, buy_price_cents descending
+# Running per-status lot counts and virtual_cost sums, kept in step with the cache
+lot_counts: Dict[int, int] = {}
+cost_totals: Dict[int, float] = {}
+# Deepest level in the ladder; lots are only ever removed by a full cache reload
+max_level = 0
+
+# Set by any lot cache change; commit_tick() turns it into a levels JSON invalidation once the change is durable
+_lots_dirty = False
+
+def _cache_add(lot: VirtualLot):
+    global max_level, _lots_dirty
+    _lots_dirty = True
+    lots_by_level[lot.level] = lot
+    max_level = max(max_level, lot.level)
+    lot_counts[lot.status] = lot_counts.get(lot.status, 0) + 1
+    cost_totals[lot.status] = cost_totals.get(lot.status, 0.0) + lot.virtual_cost
+    if lot.status == OPEN:
+        insort(open_lots, lot, key=lambda l: l.sell_target_cents)
+    elif lot.status == PENDING:
+        insort(pending_lots, lot, key=lambda l: -l.buy_price_cents)
+
+def _cache_discard(lot: VirtualLot):
+    global _lots_dirty
+    _lots_dirty = True
+    lot_counts[lot.status] -= 1
+    if lot_counts[lot.status]:
+        cost_totals[lot.status] -= lot.virtual_cost
+    else:
+        cost_totals[lot.status] = 0.0  # drop accumulated float error
+    if lot.status == OPEN:
+        open_lots.remove(lot)
+    elif lot.status == PENDING:
+        pending_lots.remove(lot)
+
+def load_lot_cache():
+    """(Re)loads the in-memory lot cache from virtual_lots."""
+    global max_level
+    max_level = 0
+    lots_by_level.clear()
+    open_lots.clear()
+    pending_lots.clear()
+    lot_counts.clear()
+    cost_totals.clear()
+    cur.execute(SQL_SELECT_LOTS)
+    for r in cur.fetchall():
+        _cache_add(VirtualLot(*r))
+
+def count_lots(status: int) -> int:
+    return lot_counts.get(status, 0)
+
+# Status UPDATEs queued since the last commit_tick(), as (status, alpaca_order_id, level)
+_pending_status_updates: List[tuple] = []
+
+def set_lot_status(level: int, status: int, alpaca_order_id: Optional[str] = None):
+    """Moves a lot to a new status in the cache; the UPDATE is written by commit_tick()."""
+    _pending_status_updates.append((status, alpaca_order_id, level))
+
+    lot = lots_by_level.get(level)
+    if lot is None:
+        return
+    _cache_discard(lot)
+    lot.status = status
+    if alpaca_order_id is not None:
+        lot.alpaca_order_id = alpaca_order_id
+    _cache_add(lot)
+
+def commit_tick():
+    """Flushes queued lot status changes and commits the tick in one transaction.
+
+    A failed tick is committed rather than rolled back: any order Alpaca already
+    accepted must stay recorded so reconcile_orders can match its fill.
+    """
+    if _pending_status_updates:
+        cur.executemany(SQL_UPDATE_LOT_STATUS, _pending_status_updates)
+        _pending_status_updates.clear()
+    conn.commit()
+    if _lots_dirty:
+        invalidate_levels_json()
+
+# Serialized /api/levels body, rebuilt on the first request after a committed lot change
+_levels_json_bytes: Optional[bytes] = None
+_levels_generation = 0
+
+def invalidate_levels_json():
+    global _levels_json_bytes, _levels_generation, _lots_dirty
+    _levels_json_bytes = None
+    _levels_generation += 1
+    _lots_dirty = False
 
 # ---------- Utility functions ----------
-def tail_log(n: int = LOG_FILE) -> str:
+def to_cents(price: float) -> int:
+    return int(round(price * 100))
+
+def from_cents(cents: int) -> float:
+    return cents / 100
+
+def tail_log(n: int = CFG.log_tail) -> str:
+    """Returns the last n lines of the log from the in-memory ring."""
+    return "\n".join(log_ring.lines(n))
+
+def _tail_log_file(n: int) -> str:
+    """Returns the last n lines of the log file, reading backwards from the end. Used to seed the ring."""
     try:
-        with open(LOG_FILE, 'r') as f:
-            lines = f.readlines()
-        return "".join(lines[-n:])
+        with open(LOG_FILE, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            block = 64 * 1024
+            while True:
+                start = max(0, size - block)
+                f.seek(start)
+                data = f.read()
+                # n+1 newlines guarantees n whole lines after the (possibly cut) first one
+                if start == 0 or data.count(b"\n") > n:
+                    break
+                block *= 2
+        lines = data.splitlines(keepends=True)
+        return b"".join(lines[-n:]).decode("utf-8", errors="replace")
     except Exception:
         return ""
 
 def clear_log():
     try:
         open(LOG_FILE, 'w').close()
+        log_ring.clear()
         logger.info("Log cleared via web UI")
         return True
     except Exception as e:
         logger.exception("Failed clearing log")
         return False
 
+# Seed the ring with what is already on disk, then keep it fed from the root logger
+log_ring.buffer.extend(_tail_log_file(log_ring.buffer.maxlen).splitlines())
+logging.getLogger().addHandler(log_ring)
+
 # --- FIXED: Clear Database (Safe Mode) ---
 def clear_db():
+    global _paused
     try:
         # CHANGED: Use DELETE instead of DROP so we don't crash the running bot
         cur.executescript("""
@@ -142,6 +466,9 @@ def clear_db():
             DELETE FROM meta;
         """)
         conn.commit()
+        load_lot_cache()
+        invalidate_levels_json()
+        _paused = None
         logger.info("Database CLEARED (content wiped, schema preserved).")
         return True
     except Exception as e:
@@ -150,12 +477,12 @@ def clear_db():
 
 
 def write_meta(key: str, val: str):
-    cur.execute("INSERT OR REPLACE INTO meta (key,val) VALUES (?,?)", (key, val))
+    cur.execute(SQL_UPSERT_META, (key, val))
     conn.commit()
 
 def read_meta(key: str) -> Optional[str]:
     try:
-        cur.execute("SELECT val FROM meta WHERE key='paused'")
+        cur.execute(SQL_SELECT_META, (key,))
         v = cur.fetchone()
         return v[0] if v else None
     except sqlite3.OperationalError:
@@ -163,164 +490,417 @@ def read_meta(key: str) -> Optional[str]:
 
 
 # --- Reconciliation Check ---
-def get_reconciliation_status() -> dict:
-    actual_shares = get_actual_position_shares()
-    
-    try:
-        cur.execute("SELECT SUM(virtual_shares) FROM virtual_lots WHERE status='OPEN'")
-        assumed_shares = cur.fetchone()[0] or 0
-        
-        cur.execute("SELECT SUM(virtual_cost) FROM virtual_lots WHERE status IN ('OPEN', 'CLOSED')")
-        total_db_allocation = cur.fetchone()[0] or 0
-    except sqlite3.OperationalError:
-        assumed_shares = 0
-        total_db_allocation = 0.0
-    
-    account_cash = 0.0
+def get_account_cash() -> float:
     try:
         if api:
             account = api.get_account()
-            account_cash = float(account.buying_power)
+            return float(account.buying_power)
     except Exception:
         pass
+    return 0.0
+
+async def get_position_status() -> dict:
+    """Compares Alpaca's position with the shares held by OPEN lots; the trading loop's per-tick check."""
+    actual_shares = await get_actual_position_shares_async()
+    assumed_shares = sum(lot.virtual_shares for lot in open_lots)
 
-    reconciled = (actual_shares == assumed_shares)
-    
     return {
-        "reconciled": reconciled,
+        "reconciled": actual_shares == assumed_shares,
         "actual_shares": actual_shares,
         "assumed_shares": assumed_shares,
         "shares_delta": actual_shares - assumed_shares,
-        "total_db_allocation": round(total_db_allocation, 2),
-        "alpaca_cash": round(account_cash, 2)
     }
 
-# ---------- Allocation Math ----------
-def compute_allocation_levels(anchor_price: float, current_level: int, starting_cash: float, rf: float, total_levels: int) -> tuple[int, float]:
-    next_level = current_level + 1
-    if next_level > total_levels:
-        return 0, 0.0
+async def get_reconciliation_status() -> dict:
+    """Position check plus account figures for the web UI."""
+    # Independent Alpaca requests; overlap their round trips
+    status, account_cash = await asyncio.gather(
+        get_position_status(), asyncio.to_thread(get_account_cash))
+    total_db_allocation = cost_totals.get(OPEN, 0.0) + cost_totals.get(CLOSED, 0.0)
 
+    status["total_db_allocation"] = round(total_db_allocation, 2)
+    status["alpaca_cash"] = round(account_cash, 2)
+    return status
+
+# ---------- Allocation Math ----------
+@lru_cache(maxsize=8)
+def allocation_ladder(anchor_cents: int, starting_cash: float, rf: float, total_levels: int) -> tuple[np.ndarray, np.ndarray]:
+    """Shares and buy price (cents) for every step of the ladder, indexed by current_level."""
+    i = np.arange(total_levels)
     denom = (1 - (rf ** total_levels)) if rf != 1.0 else total_levels
     base_alloc_factor = (1 - rf) / denom
-    alloc_cash = starting_cash * base_alloc_factor * (rf ** current_level) 
-    step_down_percent = 0.01 
-    buy_price = round(anchor_price * (1 - (next_level * step_down_percent)), 8)
-    shares = max(MIN_ORDER_SHARES, int(alloc_cash // buy_price))
-    
-    return shares, buy_price
+    alloc_cash = starting_cash * base_alloc_factor * (rf ** i)
+    step_down_percent = 0.01
+    buy_cents = np.rint(anchor_cents * (1 - ((i + 1) * step_down_percent))).astype(np.int64)
+    shares = np.maximum(CFG.min_order_shares, (alloc_cash * 100 // buy_cents).astype(np.int64))
+    return shares, buy_cents
+
+def compute_allocation_levels(anchor_cents: int, current_level: int, starting_cash: float, rf: float, total_levels: int) -> tuple[int, int]:
+    if current_level + 1 > total_levels:
+        return 0, 0
+
+    shares, buy_cents = allocation_ladder(anchor_cents, starting_cash, rf, total_levels)
+    return int(shares[current_level]), int(buy_cents[current_level])
+
+def sell_target_for(buy_cents: int) -> int:
+    return int(round(buy_cents * 1.01))
+
+def insert_virtual_lots(rows: List[tuple]):
+    """Inserts lot rows with one executemany; they are committed by commit_tick().
+
+    Each row is (level, virtual_shares, virtual_cost, buy_price_cents, sell_target_cents, status, created_at, alpaca_order_id).
+    """
+    cur.executemany(SQL_INSERT_LOTS, rows)
+    for level, vshares, vcost, buy_cents, sell_cents, status, _, order_id in rows:
+        if level not in lots_by_level:
+            _cache_add(VirtualLot(level, vshares, vcost, buy_cents, sell_cents, status, order_id))
 
 def seed_virtual_ledger_if_empty():
-    """Checks if virtual_lots table has any data."""
-    cur.execute("SELECT COUNT(1) FROM virtual_lots")
-    if cur.fetchone()[0] == 0:
+    """Loads the lot cache and checks if virtual_lots has any data."""
+    load_lot_cache()
+    if not lots_by_level:
         logger.info("Ledger is empty. Checking startup conditions...")
         
 def load_open_virtual_lots() -> List[VirtualLot]:
-    cur.execute("SELECT level, virtual_shares, virtual_cost, buy_price, sell_target, status FROM virtual_lots WHERE status='OPEN' ORDER BY level")
-    return [VirtualLot(*r) for r in cur.fetchall()]
+    return sorted(open_lots, key=lambda l: l.level)
 
 # ---------- Alpaca helpers ----------
+# (monotonic timestamp, value) of the last successful fetch. The trading loop
+# and the web UI share these so one tick does not hit Alpaca several times.
+_price_cache: tuple = (0.0, None)
+_pos_cache: tuple = (0.0, None)
+# (monotonic timestamp, price) of the last trade pushed by the websocket stream
+_stream_price: tuple = (0.0, None)
+# Set on every streamed trade and on pause/resume so the trading loop wakes before its next poll deadline
+_wake_event = asyncio.Event()
+# Monotonic time the next polled tick is due; ticks are spaced from here, not from the end of the last tick
+_next_tick_at = 0.0
+# Monotonic time the last tick started; no tick starts sooner than poll_seconds after it
+_last_tick_at = 0.0
+
+def invalidate_position_cache():
+    global _pos_cache
+    _pos_cache = (0.0, None)
+
+async def _on_trade(trade):
+    """Stream handler: records the latest trade price."""
+    global _stream_price
+    if trade.price and trade.price > 0:
+        _stream_price = (time.monotonic(), float(trade.price))
+        _wake_event.set()
+
+async def price_stream():
+    """Feeds _stream_price from Alpaca's trade websocket; REST polling covers any gap.
+
+    The stream is rebuilt after a failure, waiting 1s, 2s, 4s... (capped at 60s) between attempts.
+    """
+    backoff = 1
+    while True:
+        stream = StockDataStream(ALPACA_API_KEY, ALPACA_API_SECRET)
+        stream.subscribe_trades(_on_trade, CFG.symbol)
+        logger.info(f"Trade stream started for {CFG.symbol}")
+        started = time.monotonic()
+        try:
+            # _run_forever is private SDK API: the public run() starts its own event loop,
+            # which cannot be nested inside ours. Recheck it when upgrading alpaca-py.
+            await stream._run_forever()
+        except asyncio.CancelledError:
+            await stream.stop_ws()
+            raise
+        except Exception:
+            logger.exception("Trade stream stopped; REST price polling covers it until the stream reconnects")
+        if time.monotonic() - started > 60:
+            backoff = 1
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 60)
+
+def stream_is_live() -> bool:
+    ts, streamed = _stream_price
+    return streamed is not None and time.monotonic() - ts < STREAM_STALE_SEC
+
+async def wait_for_next_tick():
+    """Waits until the next poll deadline, or a streamed trade or pause/resume, whichever is first.
+
+    Wake-ups are merged: a tick never starts sooner than poll_seconds after the previous
+    one, so a busy tape cannot turn into more Alpaca REST calls than the poll interval allows.
+    """
+    global _next_tick_at, _last_tick_at
+    now = time.monotonic()
+    if _next_tick_at <= now:
+        # Deadline reached, or missed by a slow tick: schedule the next one and drop any missed ticks
+        _next_tick_at = max(_next_tick_at + CFG.poll_seconds, now)
+    try:
+        await asyncio.wait_for(_wake_event.wait(), _next_tick_at - now)
+    except asyncio.TimeoutError:
+        pass
+    gap = _last_tick_at + CFG.poll_seconds - time.monotonic()
+    if gap > 0:
+        await asyncio.sleep(gap)
+    # Cleared only now so every trade seen while waiting folds into this one tick
+    _wake_event.clear()
+    _last_tick_at = time.monotonic()
+
+def _fresh_price() -> Optional[float]:
+    """The streamed price, or the REST price while still within its TTL; None if a fetch is needed."""
+    if stream_is_live():
+        return _stream_price[1]
+    ts, cached = _price_cache
+    if cached is not None and time.monotonic() - ts < QUOTE_CACHE_TTL_SEC:
+        return cached
+    return None
+
 def get_latest_price() -> Optional[float]:
+    """Returns the latest streamed trade price, falling back to REST polling if the stream is stale."""
+    global _price_cache
+    price = _fresh_price()
+    if price is not None:
+        return price
+
+    price = fetch_latest_price()
+    if price is not None:
+        _price_cache = (time.monotonic(), price)
+    return price
+
+def fetch_latest_price() -> Optional[float]:
     if not data_api:
         return None
     try:
-        req = StockLatestTradeRequest(symbol_or_symbols=[SYMBOL])
+        req = StockLatestTradeRequest(symbol_or_symbols=[CFG.symbol])
         trade = data_api.get_stock_latest_trade(req)
-        return float(trade[SYMBOL].price)
+        return float(trade[CFG.symbol].price)
     except Exception:
         pass
 
     try:
-        req = StockBarsRequest(symbol_or_symbols=[SYMBOL], timeframe=TimeFrame.Minute, limit=1)
+        req = StockBarsRequest(symbol_or_symbols=[CFG.symbol], timeframe=TimeFrame.Minute, limit=1)
         bars = data_api.get_stock_bars(req)
-        if bars and SYMBOL in bars and len(bars[SYMBOL]) > 0:
-             return float(bars[SYMBOL][0].close)
+        if bars and CFG.symbol in bars and len(bars[CFG.symbol]) > 0:
+             return float(bars[CFG.symbol][0].close)
     except Exception:
         logger.exception("Final price fetch failed")
     return None
 
+def _fresh_position() -> Optional[int]:
+    ts, cached = _pos_cache
+    if cached is not None and time.monotonic() - ts < QUOTE_CACHE_TTL_SEC:
+        return cached
+    return None
+
 def get_actual_position_shares() -> int:
+    global _pos_cache
+    cached = _fresh_position()
+    if cached is not None:
+        return cached
     if not api:
         return 0
     try:
-        p = api.get_open_position(SYMBOL)
-        return int(float(p.qty))
+        p = api.get_open_position(CFG.symbol)
+        shares = int(float(p.qty))
     except Exception:
-        return 0
+        # Alpaca raises when there is no open position
+        shares = 0
+    _pos_cache = (time.monotonic(), shares)
+    return shares
+
+# The SDK calls are blocking HTTP requests; these run them off the event loop
+# so the web UI stays responsive while Alpaca is slow. SQLite and the lot
+# cache are only ever touched from the event loop thread.
+# Cache hits are answered inline; only an actual fetch pays for the thread hop.
+async def get_latest_price_async() -> Optional[float]:
+    price = _fresh_price()
+    if price is not None:
+        return price
+    return await asyncio.to_thread(get_latest_price)
+
+async def get_actual_position_shares_async() -> int:
+    shares = _fresh_position()
+    if shares is not None:
+        return shares
+    return await asyncio.to_thread(get_actual_position_shares)
+
+# ---------- Session guard ----------
+# Extended-hours limit orders are accepted 04:00-20:00 ET on trading days; outside that Alpaca rejects them
+MARKET_TZ = ZoneInfo("America/New_York")
+EXTENDED_SESSION = (dtime(4, 0), dtime(20, 0))
+CALENDAR_LOOKAHEAD_DAYS = 14
 
-def submit_order(side_str: str, qty: int, price: float) -> Optional[str]:
+_trading_days: Optional[set] = None
+_trading_days_until: Optional[date] = None
+_calendar_loaded_on: Optional[date] = None
+_session_closed_logged = False
+
+def load_trading_calendar():
+    """Caches the upcoming trading dates so holidays are known without a per-order API call. At most once a day."""
+    global _trading_days, _trading_days_until, _calendar_loaded_on
+    today = datetime.now(MARKET_TZ).date()
+    if not api or _calendar_loaded_on == today:
+        return
+    _calendar_loaded_on = today
+    until = today + timedelta(days=CALENDAR_LOOKAHEAD_DAYS)
+    try:
+        days = api.get_calendar(GetCalendarRequest(start=today, end=until))
+        _trading_days = {d.date for d in days}
+        _trading_days_until = until
+    except Exception:
+        logger.exception("Failed loading market calendar; falling back to weekday check")
+
+def market_session_open() -> bool:
+    now = datetime.now(MARKET_TZ)
+    if not EXTENDED_SESSION[0] <= now.time() < EXTENDED_SESSION[1]:
+        return False
+    if _trading_days is not None and now.date() <= _trading_days_until:
+        return now.date() in _trading_days
+    return now.weekday() < 5
+
+_SIDE_MAP = {"buy": OrderSide.BUY, "sell": OrderSide.SELL}
+# Every order shares symbol/TIF/session; only qty, side and limit vary per call
+_limit_order = partial(LimitOrderRequest, symbol=CFG.symbol, time_in_force=TimeInForce.DAY, extended_hours=True)
+
+async def submit_order(side_str: str, qty: int, price: float) -> Optional[str]:
+    global _session_closed_logged
     if qty <= 0 or not api:
         return None
+    if not market_session_open():
+        # The order would be rejected anyway; skip the round-trip and log once per closed period
+        if not _session_closed_logged:
+            logger.info("Market session closed; holding orders until it reopens")
+            _session_closed_logged = True
+        return None
+    _session_closed_logged = False
     
-    side = OrderSide.BUY if side_str.lower() == 'buy' else OrderSide.SELL
-    
-    req = LimitOrderRequest(
-        symbol=SYMBOL,
-        qty=qty,
-        side=side,
-        limit_price=round(price, 2),
-        time_in_force=TimeInForce.DAY,
-        extended_hours=True
-    )
+    req = _limit_order(qty=qty, side=_SIDE_MAP[side_str], limit_price=round(price, 2))
 
     try:
-        order = api.submit_order(order_data=req)
-        cur.execute("INSERT INTO orders (alpaca_id, side, qty, price, status, created_at) VALUES (?,?,?,?,?,?)",
-                    (str(order.id), side_str, qty, price, str(order.status), int(time.time())))
-        conn.commit()
+        order = await asyncio.to_thread(api.submit_order, order_data=req)
+        invalidate_position_cache()
+        cur.execute(SQL_INSERT_ORDER, (str(order.id), side_str, qty, price, str(order.status), int(time.time())))
         logger.info(f"Submitted LIMIT {side_str} order qty={qty} @ ${price:.2f}")
         return str(order.id)
     except Exception as e:
         logger.error(f"Order failed: {e}") 
         return None
 
-def reconcile_orders():
+def fetch_orders_since(created_at: int) -> dict:
+    """Returns orders for the configured symbol submitted since created_at (epoch seconds), keyed by Alpaca order id."""
+    req = GetOrdersRequest(
+        status=QueryOrderStatus.ALL,
+        symbols=[CFG.symbol],
+        after=datetime.fromtimestamp(created_at - 60, tz=timezone.utc),
+        limit=500
+    )
+    return {str(o.id): o for o in api.get_orders(filter=req)}
+
+async def reconcile_orders():
     if not api:
         return
     try:
-        cur.execute("SELECT id, alpaca_id FROM orders WHERE status NOT IN ('filled','canceled','expired')")
+        cur.execute(SQL_SELECT_UNRESOLVED_ORDERS)
         rows = cur.fetchall()
-        for rid, aid in rows:
-            try:
-                o = api.get_order_by_id(aid)
-                order_status = str(o.status)
+        if not rows:
+            return
 
-                cur.execute("SELECT level FROM virtual_lots WHERE alpaca_order_id=?", (aid,))
-                lot_level_result = cur.fetchone()
-                lot_level = lot_level_result[0] if lot_level_result else None
+        # One request for every unresolved order instead of one get_order_by_id each
+        try:
+            batch = await asyncio.to_thread(fetch_orders_since, min(r[3] for r in rows))
+        except Exception as e:
+            logger.error(f"Batch order lookup failed: {e}")
+            batch = {}
 
-                cur.execute("UPDATE orders SET status=? WHERE id=?", (order_status, rid))
+        # Anything the batch missed is looked up individually, a few at a time
+        sem = asyncio.Semaphore(RECONCILE_CONCURRENCY)
 
-                if order_status == 'filled' and lot_level is not None:
-                    cur.execute("SELECT side FROM orders WHERE alpaca_id=?", (aid,))
-                    order_side = cur.fetchone()
-                    
-                    if order_side and order_side[0] == 'buy':
-                        cur.execute("UPDATE virtual_lots SET status='OPEN' WHERE level=?", (lot_level,))
-                        logger.info(f"Lot Level {lot_level} moved to OPEN (Filled).")
-                    elif order_side and order_side[0] == 'sell':
-                        cur.execute("UPDATE virtual_lots SET status='CLOSED' WHERE level=?", (lot_level,))
-                        logger.info(f"Lot Level {lot_level} moved to CLOSED (Sold).")
-
-            except Exception as e:
-                logger.error(f"Failed to reconcile order {aid}: {e}")
-                pass
-        conn.commit()
+        async def lookup(aid):
+            async with sem:
+                try:
+                    return aid, await asyncio.to_thread(api.get_order_by_id, aid)
+                except Exception as e:
+                    logger.error(f"Failed to reconcile order {aid}: {e}")
+                    return aid, None
+
+        missing = [aid for _, aid, _, _ in rows if aid not in batch]
+        for aid, o in await asyncio.gather(*(lookup(aid) for aid in missing)):
+            if o is not None:
+                batch[aid] = o
+
+        # Lots that crossed in the same tick share one aggregated order
+        levels_by_order: Dict[str, List[int]] = {}
+        for lot in lots_by_level.values():
+            if lot.alpaca_order_id:
+                levels_by_order.setdefault(lot.alpaca_order_id, []).append(lot.level)
+        status_updates = []
+        for rid, aid, side, _ in rows:
+            o = batch.get(aid)
+            if o is None:
+                continue
+            order_status = str(o.status)
+            status_updates.append((order_status, rid))
+            if order_status != 'filled':
+                continue
+
+            invalidate_position_cache()
+            for lot_level in levels_by_order.get(aid, ()):
+                if side == 'buy':
+                    set_lot_status(lot_level, OPEN)
+                    logger.info(f"Lot Level {lot_level} moved to OPEN (Filled).")
+                elif side == 'sell':
+                    set_lot_status(lot_level, CLOSED)
+                    logger.info(f"Lot Level {lot_level} moved to CLOSED (Sold).")
+
+        cur.executemany(SQL_UPDATE_ORDER_STATUS, status_updates)
+        commit_tick()
     except Exception:
         logger.exception("Reconcile loop failed")
 
+async def reconcile_loop():
+    """Reconciles order fills on a slower cadence than the trading loop, and periodically maintains the ledger."""
+    last_checkpoint = time.monotonic()
+    while True:
+        await reconcile_orders()
+        await asyncio.to_thread(load_trading_calendar)
+        if time.monotonic() - last_checkpoint >= WAL_CHECKPOINT_INTERVAL_SEC:
+            try:
+                analyze_if_missing_stats()
+                await asyncio.to_thread(_checkpoint_wal)
+            except sqlite3.Error:
+                logger.exception("Ledger maintenance failed")
+            last_checkpoint = time.monotonic()
+        await asyncio.sleep(RECONCILE_INTERVAL_SEC)
+
 # ---------- Safety / Maintenance ----------
+# Mirrors meta['paused']; None until first read or after the meta table is wiped
+_paused: Optional[bool] = None
+
 def is_paused() -> bool:
-    try:
-        cur.execute("SELECT val FROM meta WHERE key='paused'")
-        v = cur.fetchone()
-        return v[0] == "1" if v else False
-    except sqlite3.OperationalError:
-        return False
+    global _paused
+    if _paused is None:
+        try:
+            cur.execute(SQL_SELECT_META, ("paused",))
+            v = cur.fetchone()
+            _paused = v[0] == "1" if v else False
+        except sqlite3.OperationalError:
+            return False
+    return _paused
 
 def set_paused(val: bool):
+    global _paused
     write_meta("paused", "1" if val else "0")
+    _paused = val
+    _wake_event.set()
+
+def is_quiet_tick(price_cents: int) -> bool:
+    """True when no lot can trigger at price_cents and the ladder needs no new PENDING lot.
+
+    The heads of open_lots / pending_lots are the nearest sell and buy thresholds.
+    """
+    if not lots_by_level:
+        return False
+    if not pending_lots and count_lots(ORDER_SENT) == 0:
+        return False
+    if open_lots and price_cents >= open_lots[0].sell_target_cents:
+        return False
+    if pending_lots and price_cents <= pending_lots[0].buy_price_cents:
+        return False
+    return True
 
 # ---------- Core trading loop ----------
 async def trading_loop():
@@ -330,176 +910,162 @@ async def trading_loop():
         seed_virtual_ledger_if_empty()
     except Exception as e:
         logger.critical(f"Failed to seed ledger: {e}")
+
+    # Started after seeding so fills are matched against a loaded lot cache
+    reconcile_task = asyncio.create_task(reconcile_loop())
+    last_paused_log = 0.0
         
     while True:
         try:
-            reconcile_orders()
-            
             if is_paused():
-                logger.info("Bot is paused (maintenance). Sleeping.")
-                await asyncio.sleep(POLL_MS/1000)
+                if time.monotonic() - last_paused_log >= PAUSED_LOG_INTERVAL_SEC:
+                    logger.info("Bot is paused (maintenance). Sleeping.")
+                    last_paused_log = time.monotonic()
+                await wait_for_next_tick()
                 continue
 
-            price = get_latest_price()
+            price = await get_latest_price_async()
             if price is None:
-                await asyncio.sleep(POLL_MS/1000)
+                await wait_for_next_tick()
+                continue
+            price_cents = to_cents(price)
+
+            # Nothing can trigger between the nearest thresholds; skip the Alpaca
+            # position/account lookups and both scans until the price crosses one
+            if is_quiet_tick(price_cents):
+                await wait_for_next_tick()
                 continue
 
-            reconciliation_status = get_reconciliation_status()
+            reconciliation_status = await get_position_status()
             actual_shares = reconciliation_status['actual_shares']
 
             # --- STARTUP LOGIC: RUN BEFORE SAFETY CHECK ---
             # If the DB is empty (after clear) but we have shares, we MUST adopt them.
-            cur.execute("SELECT COUNT(1) FROM virtual_lots")
-            db_row_count = cur.fetchone()[0]
-            
-            if db_row_count == 0:
+            if not lots_by_level:
                 if actual_shares > 0:
                     # SCENARIO A: Adopt Existing Shares
                     logger.warning(f"Startup/Reset: Found {actual_shares} existing shares in Alpaca but DB is empty.")
                     logger.warning("ADOPTING existing position as Level 1 Anchor to prevent double-buy.")
                     
-                    sell_target = round(price * 1.01, 8)
-                    cur.execute("""INSERT INTO virtual_lots
-                        (level, virtual_shares, virtual_cost, buy_price, sell_target, status, created_at)
-                        VALUES (?,?,?,?,?,?,?)""",
-                        (1, actual_shares, price * actual_shares, price, sell_target, "OPEN", int(time.time())))
-                    conn.commit()
+                    insert_virtual_lots([(1, actual_shares, price * actual_shares, price_cents, sell_target_for(price_cents), OPEN, int(time.time()), None)])
                     logger.info("Existing shares adopted. Grid initiated from current position.")
                     continue # Loop back to refresh status with new DB data
                 
                 else:
                     # SCENARIO B: Clean Start (Buy Level 1)
                     logger.info("Clean start detected. Placing Level 1 Anchor Buy.")
-                    target_price = price 
-                    aggressive_limit_price = round(target_price + 0.05, 2)
-                    qty, buy_price_calc = compute_allocation_levels(target_price, 0, INITIAL_CASH, RF, LEVELS)
+                    aggressive_limit_price = from_cents(price_cents + 5)
+                    qty, buy_price_calc = compute_allocation_levels(price_cents, 0, CFG.initial_cash, CFG.rf, CFG.levels)
 
-                    if qty > 0 and qty <= MAX_POSITION_SHARES:
-                        sell_target = round(target_price * 1.01, 8) 
-                        order_id = submit_order("buy", qty, aggressive_limit_price)
+                    if qty > 0 and qty <= CFG.max_position_shares:
+                        order_id = await submit_order("buy", qty, aggressive_limit_price)
                         
                         if order_id:
-                            cur.execute("""INSERT OR IGNORE INTO virtual_lots
-                                (level, virtual_shares, virtual_cost, buy_price, sell_target, status, created_at, alpaca_order_id)
-                                VALUES (?,?,?,?,?,?,?,?)""",
-                                (1, qty, target_price*qty, target_price, sell_target, "ORDER_SENT", int(time.time()), order_id))
-                            conn.commit()
+                            insert_virtual_lots([(1, qty, from_cents(price_cents)*qty, price_cents, sell_target_for(price_cents), ORDER_SENT, int(time.time()), order_id)])
                             logger.info(f"Anchor Buy submitted: QTY={qty} @ ${aggressive_limit_price:.2f}.")
-                            await asyncio.sleep(POLL_MS/1000)
+                            await wait_for_next_tick()
                             continue
             # --- END STARTUP LOGIC ---
 
             # --- SAFETY CHECK (Run AFTER potential adoption) ---
             if not reconciliation_status['reconciled']:
                 # Grace period check
-                cur.execute("SELECT COUNT(1) FROM virtual_lots WHERE status='ORDER_SENT'")
-                orders_in_flight = cur.fetchone()[0]
+                orders_in_flight = count_lots(ORDER_SENT)
                 
                 if orders_in_flight > 0:
                     logger.info(f"Reconciliation Mismatch ({reconciliation_status['shares_delta']} shares), but {orders_in_flight} orders are in flight. Assuming grace period/partial fill. Continuing.")
                 else:
                     logger.warning(f"RECONCILIATION MISMATCH: DB Assumed {reconciliation_status['assumed_shares']} shares, Alpaca reports {reconciliation_status['actual_shares']} shares. Delta: {reconciliation_status['shares_delta']}. Bot action paused.")
-                    await asyncio.sleep(POLL_MS/1000)
+                    await wait_for_next_tick()
                     continue
 
             # --- RUNNING LOGIC ---
             
             # 1. SELL logic
-            cur.execute("SELECT level, virtual_shares, sell_target FROM virtual_lots WHERE status='OPEN' ORDER BY level")
-            open_lots = cur.fetchall()
-            
-            for level, vshares, sell_target in open_lots:
-                if price >= sell_target:
-                    qty = min(int(vshares), actual_shares) 
-                    if qty >= MIN_ORDER_SHARES:
-                        logger.info("SELL TRIGGER level=%s sell_target=%s price=%s qty=%s", level, sell_target, price, qty)
-                        limit_price = round(sell_target - 0.05, 2) # Buffer
-                        order_id = submit_order("sell", qty, limit_price)
-                        if order_id:
-                            cur.execute("UPDATE virtual_lots SET status='ORDER_SENT', alpaca_order_id=? WHERE level=?", (order_id, level))
-                            conn.commit()
+            # open_lots is sorted by sell target, so only the head of the list can trigger.
+            # Position was read once for the tick; each crossed lot takes its shares from it
+            shares_unsold = actual_shares
+            sells = []
+            for lot in open_lots[:bisect_right(open_lots, price_cents, key=lambda l: l.sell_target_cents)]:
+                qty = min(int(lot.virtual_shares), shares_unsold)
+                if qty >= CFG.min_order_shares:
+                    logger.info("SELL TRIGGER level=%s sell_target=%s price=%s qty=%s", lot.level, from_cents(lot.sell_target_cents), price, qty)
+                    sells.append(lot)
+                    shares_unsold -= qty
+            if sells:
+                # One order for every lot that crossed; limit at the highest target so no lot sells below its own
+                limit_price = from_cents(sells[-1].sell_target_cents - 5) # Buffer
+                order_id = await submit_order("sell", actual_shares - shares_unsold, limit_price)
+                if order_id:
+                    for lot in sells:
+                        set_lot_status(lot.level, ORDER_SENT, order_id)
 
             # 2. BUY logic
-            cur.execute("SELECT level, virtual_shares, buy_price FROM virtual_lots WHERE status='PENDING' ORDER BY level DESC")
-            pending_rows = cur.fetchall()
-            
-            cur.execute("SELECT COUNT(1) FROM virtual_lots WHERE status='ORDER_SENT'")
-            orders_sent_count = cur.fetchone()[0]
-            
-            if not pending_rows and orders_sent_count == 0:
-                cur.execute("SELECT MAX(level) FROM virtual_lots")
-                max_level = cur.fetchone()[0] or 0
-                cur.execute("SELECT buy_price FROM virtual_lots WHERE level=1")
-                anchor_result = cur.fetchone()
-                anchor_price = anchor_result[0] if anchor_result else 0.0 
+            if not pending_lots and count_lots(ORDER_SENT) == 0:
+                anchor_lot = lots_by_level.get(1)
+                anchor_cents = anchor_lot.buy_price_cents if anchor_lot else 0
                 
-                if anchor_price > 0:
-                    qty, buy_target_price = compute_allocation_levels(anchor_price, max_level, INITIAL_CASH, RF, LEVELS)
-                    if qty > 0 and buy_target_price > 0:
-                        sell_target = round(buy_target_price * 1.01, 8) 
-                        cur.execute("""INSERT INTO virtual_lots
-                            (level, virtual_shares, virtual_cost, buy_price, sell_target, status, created_at)
-                            VALUES (?,?,?,?,?,?,?)""",
-                            (max_level + 1, qty, buy_target_price*qty, buy_target_price, sell_target, "PENDING", int(time.time())))
-                        conn.commit()
-                        logger.info(f"Prepared next pending lot: Level {max_level + 1} @ ${buy_target_price:.2f}")
-
-            cur.execute("SELECT level, virtual_shares, buy_price FROM virtual_lots WHERE status='PENDING' ORDER BY level DESC")
-            pending_rows = cur.fetchall()
-
-            for level, vshares, buy_price in pending_rows:
-                if price <= buy_price:
-                    if actual_shares + vshares > MAX_POSITION_SHARES:
-                        logger.info("Safety cap would be exceeded; skipping buy for level %s", level)
-                        continue
-                        
-                    qty = int(vshares)
-                    if qty < MIN_ORDER_SHARES:
-                        continue
-                        
-                    logger.info("BUY TRIGGER level=%s buy_price=%s price=%s qty=%s", level, buy_price, price, qty)
-                    limit_price = round(buy_price + 0.05, 2) # Buffer
-                    order_id = submit_order("buy", qty, limit_price)
-                    if order_id:
-                        cur.execute("UPDATE virtual_lots SET status='ORDER_SENT', alpaca_order_id=? WHERE level=?", (order_id, level))
-                        conn.commit()
+                if anchor_cents > 0:
+                    # Stage the next few ladder levels at once so a fast drop can buy through them
+                    now = int(time.time())
+                    rows = []
+                    for level in range(max_level, min(max_level + PENDING_LOOKAHEAD, CFG.levels)):
+                        qty, buy_cents = compute_allocation_levels(anchor_cents, level, CFG.initial_cash, CFG.rf, CFG.levels)
+                        if qty > 0 and buy_cents > 0:
+                            rows.append((level + 1, qty, from_cents(buy_cents)*qty, buy_cents, sell_target_for(buy_cents), PENDING, now, None))
+                    if rows:
+                        insert_virtual_lots(rows)
+                        logger.info(f"Prepared pending lots: Levels {rows[0][0]}-{rows[-1][0]} @ ${from_cents(rows[0][3]):.2f}-${from_cents(rows[-1][3]):.2f}")
+
+            # pending_lots is sorted by buy price descending; same early cut-off as above
+            # Several levels can trigger in one tick, so count shares already ordered against the cap
+            position_after_buys = actual_shares
+            buys = []
+            for lot in pending_lots[:bisect_right(pending_lots, -price_cents, key=lambda l: -l.buy_price_cents)]:
+                if position_after_buys + lot.virtual_shares > CFG.max_position_shares:
+                    logger.info("Safety cap would be exceeded; skipping buy for level %s", lot.level)
+                    continue
+                    
+                qty = int(lot.virtual_shares)
+                if qty < CFG.min_order_shares:
+                    continue
+                    
+                logger.info("BUY TRIGGER level=%s buy_price=%s price=%s qty=%s", lot.level, from_cents(lot.buy_price_cents), price, qty)
+                buys.append(lot)
+                position_after_buys += qty
+            if buys:
+                # Same aggregation as sells; limit at the lowest buy price so no lot pays above its own
+                limit_price = from_cents(buys[-1].buy_price_cents + 5) # Buffer
+                order_id = await submit_order("buy", position_after_buys - actual_shares, limit_price)
+                if order_id:
+                    for lot in buys:
+                        set_lot_status(lot.level, ORDER_SENT, order_id)
             
         except Exception:
             logger.exception("Exception in trading loop")
+        finally:
+            try:
+                commit_tick()
+            except Exception:
+                logger.exception("Failed to commit trading loop tick")
             
-        await asyncio.sleep(POLL_MS/1000)
+        await wait_for_next_tick()
 
 # ---------- Web UI ----------
-async def handle_index(request):
-    price = get_latest_price()
-    pos = get_actual_position_shares()
-    cur.execute("SELECT SUM(virtual_cost) FROM virtual_lots WHERE status='OPEN'")
-    r = cur.fetchone()
-    open_cost = r[0] if r and r[0] else 0.0
-    
-    cur.execute("SELECT SUM(virtual_cost) FROM virtual_lots WHERE status='CLOSED'")
-    r = cur.fetchone()
-    closed_cost = r[0] if r and r[0] else 0.0
-    
-    reco_status = get_reconciliation_status()
-    reco_alert = ""
-    if not reco_status['reconciled']:
-        reco_alert = f"""<p style='color:red; font-weight:bold;'>WARNING: Share Mismatch! DB ({reco_status['assumed_shares']}) != Alpaca ({reco_status['actual_shares']})</p>"""
-    
-    html = f"""
+# Static page skeleton; handle_index only fills in the dynamic fields
+_INDEX_TEMPLATE = """
     <html>
     <head><title>TQQQ Bot Status</title></head>
     <body>
       <h2>TQQQ Bot Status</h2>
       {reco_alert}
-      <p>Symbol: {SYMBOL}</p>
+      <p>Symbol: {symbol}</p>
       <p>Current Price: {price}</p>
       <p>Actual Position Shares (Alpaca): {pos}</p>
       <p>Open Virtual Cost (sum): {open_cost:.2f}</p>
       <p>Closed Virtual Cost (sum): {closed_cost:.2f}</p>
-      <p>Reduction Factor: {RF}</p>
-      <p>Levels configured: {LEVELS}</p>
+      <p>Reduction Factor: {rf}</p>
+      <p>Levels configured: {levels}</p>
       <p><a href="/api/levels">View full levels (JSON)</a></p>
       
       <form method="post" action="/api/clear-logs" style="display:inline;"><button type="submit">Clear Logs</button></form>
@@ -509,56 +1075,98 @@ async def handle_index(request):
       
       <h3>Reconciliation Data</h3>
       <ul>
-        <li>Shares Delta (Actual - Assumed): {reco_status['shares_delta']}</li>
-        <li>Account Buying Power: ${reco_status['alpaca_cash']:.2f}</li>
+        <li>Shares Delta (Actual - Assumed): {shares_delta}</li>
+        <li>Account Buying Power: ${alpaca_cash:.2f}</li>
       </ul>
       
       <h3>Recent logs</h3>
-      <pre>{tail_log(200)}</pre>
+      <pre>{logs}</pre>
     </body>
     </html>
     """
-    return web.Response(text=html, content_type='text/html')
+
+# Bodies below this size are sent as-is; gzip overhead isn't worth it for small payloads
+COMPRESS_MIN_BYTES = 1024
+
+def _uncached_response(payload, content_type: str) -> web.Response:
+    """Builds a no-store response from str or bytes, compressed when large enough and the client accepts it."""
+    headers = {"Cache-Control": "no-store"}
+    if isinstance(payload, bytes):
+        resp = web.Response(body=payload, content_type=content_type, headers=headers)
+    else:
+        resp = web.Response(text=payload, content_type=content_type, headers=headers)
+    if len(payload) >= COMPRESS_MIN_BYTES:
+        resp.enable_compression()
+    return resp
+
+async def handle_index(request):
+    price, pos = await asyncio.gather(get_latest_price_async(), get_actual_position_shares_async())
+    open_cost = cost_totals.get(OPEN, 0.0)
+    closed_cost = cost_totals.get(CLOSED, 0.0)
+    
+    reco_status = await get_reconciliation_status()
+    reco_alert = ""
+    if not reco_status['reconciled']:
+        reco_alert = f"""<p style='color:red; font-weight:bold;'>WARNING: Share Mismatch! DB ({reco_status['assumed_shares']}) != Alpaca ({reco_status['actual_shares']})</p>"""
+    
+    html = _INDEX_TEMPLATE.format(
+        reco_alert=reco_alert,
+        symbol=CFG.symbol,
+        price=price,
+        pos=pos,
+        open_cost=open_cost,
+        closed_cost=closed_cost,
+        rf=CFG.rf,
+        levels=CFG.levels,
+        shares_delta=reco_status['shares_delta'],
+        alpaca_cash=reco_status['alpaca_cash'],
+        logs=tail_log(200)
+    )
+    return _uncached_response(html, 'text/html')
 
 async def api_clear_db(request):
     clear_db()
     raise web.HTTPFound('/')
 
 async def api_status(request):
-    price = get_latest_price()
-    pos = get_actual_position_shares()
-    cur.execute("SELECT COUNT(1) FROM virtual_lots WHERE status='OPEN'")
-    open_count = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(1) FROM virtual_lots WHERE status='CLOSED'")
-    closed_count = cur.fetchone()[0]
+    price, pos = await asyncio.gather(get_latest_price_async(), get_actual_position_shares_async())
+    open_count = count_lots(OPEN)
+    closed_count = count_lots(CLOSED)
     data = {
-        "symbol": SYMBOL,
+        "symbol": CFG.symbol,
         "price": price,
         "position_shares": pos,
         "open_virtual_lots": open_count,
         "closed_virtual_lots": closed_count,
-        "reduction_factor": RF,
+        "reduction_factor": CFG.rf,
         "paused": is_paused()
     }
-    return web.json_response(data)
+    return web.json_response(data, headers={"Cache-Control": "no-store"})
 
 async def api_levels(request):
-    cur.execute("SELECT level, virtual_shares, virtual_cost, buy_price, sell_target, status FROM virtual_lots ORDER BY level")
-    rows = cur.fetchall()
-    levels = []
-    for r in rows:
-        levels.append({
-            "level": r[0],
-            "virtual_shares": r[1],
-            "virtual_cost": r[2],
-            "buy_price": r[3],
-            "sell_target": r[4],
-            "status": r[5]
-        })
-    return web.json_response({"levels": levels})
+    global _levels_json_bytes
+    body = _levels_json_bytes
+    if body is None:
+        generation = _levels_generation
+        rows = await _db(SQL_SELECT_LEVELS)
+        levels = []
+        for r in rows:
+            levels.append({
+                "level": r[0],
+                "virtual_shares": r[1],
+                "virtual_cost": r[2],
+                "buy_price": from_cents(r[3]),
+                "sell_target": from_cents(r[4]),
+                "status": STATUS_NAMES[r[5]]
+            })
+        body = json.dumps({"levels": levels}).encode()
+        # A commit that landed during the read makes this body stale; serve it once but don't keep it
+        if generation == _levels_generation:
+            _levels_json_bytes = body
+    return _uncached_response(body, 'application/json')
 
 async def api_logs(request):
-    return web.Response(text=tail_log(LOG_TAIL), content_type='text/plain')
+    return _uncached_response(tail_log(CFG.log_tail), 'text/plain')
 
 async def api_clear_logs(request):
     clear_log()
@@ -588,16 +1196,25 @@ async def main():
     
     loop = asyncio.get_event_loop()
     app = create_web_app()
-    runner = web.AppRunner(app)
+    # Dashboards poll the API every few seconds; per-request access lines would swamp bot.log
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', WEBUI_PORT)
+    site = web.TCPSite(runner, '0.0.0.0', CFG.webui_port)
     await site.start()
-    logger.info(f"Web UI listening on port {WEBUI_PORT}")
+    logger.info(f"Web UI listening on port {CFG.webui_port}")
+
+    stream_task = asyncio.create_task(price_stream()) if data_api else None
+
+    # Open the TLS connections before the first tick needs them
+    await asyncio.gather(get_latest_price_async(), get_actual_position_shares_async())
 
     await trading_loop()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Shutting down bot")
\ No newline at end of file